@@ -9,13 +9,19 @@ Outputs:
 
 Notes:
 - Conversion success depends on coremltools + torch compatibility on your machine.
-- The exported model is fixed-shape for a specific window length (default: 3.0s @ 16kHz).
+- The exported model accepts a small set of enumerated window lengths (1s, 2s, 3s, 5s,
+  plus `--seconds`); `--seconds` (default: 3.0s @ 16kHz) is the default shape.
+  If conversion has to fall back to `torch.jit.trace`, the model is fixed-shape at
+  `--seconds`.
+- Every window length is checked against PyTorch on macOS; conversion aborts on a
+  failed prediction or a cosine below `--min-cosine`.
 """
 
 from __future__ import annotations
 
 import argparse
 import os
+import sys
 from pathlib import Path
 
 import numpy as np
@@ -38,7 +44,6 @@ def _patch_torchaudio_for_speechbrain() -> None:
     try:
         import torchaudio  # type: ignore
     except Exception:
-        import sys
         import types
 
         torchaudio = types.ModuleType("torchaudio")  # type: ignore
@@ -61,7 +66,7 @@ def _patch_torchaudio_for_speechbrain() -> None:
 def parse_args() -> argparse.Namespace:
     p = argparse.ArgumentParser()
     p.add_argument("--out", required=True, help="Output directory")
-    p.add_argument("--seconds", type=float, default=3.0, help="Fixed window length in seconds")
+    p.add_argument("--seconds", type=float, default=3.0, help="Default window length in seconds")
     p.add_argument("--sr", type=int, default=16000, help="Sample rate")
     p.add_argument(
         "--model",
@@ -69,6 +74,12 @@ def parse_args() -> argparse.Namespace:
         help="SpeechBrain HF model id",
     )
     p.add_argument("--device", default="cpu", help="cpu or mps")
+    p.add_argument(
+        "--min-cosine",
+        type=float,
+        default=0.99,
+        help="Refuse to save if CoreML vs PyTorch embedding cosine (any window length, fp16 or int8) is below this",
+    )
     return p.parse_args()
 
 
@@ -89,6 +100,148 @@ class ECAPAPipeline(torch.nn.Module):
         return emb
 
 
+# MIL ops kept in FP32. ECAPA's attentive statistics pooling computes
+# `(m * (x - mean).pow(2)).sum(dim).clamp(eps)` over ~300 frames, then a sqrt,
+# and the norm layers divide by that variance. These op types match model-wide
+# (feature extraction included); everything else stays FP16.
+_FP32_OP_TYPES = frozenset(
+    {
+        "pow",
+        "square",
+        "reduce_sum",
+        "reduce_sum_square",
+        "reduce_mean",
+        "sqrt",
+        "rsqrt",
+        "layer_norm",
+        "batch_norm",
+    }
+)
+
+# The element-wise glue around the reductions must be FP32 as well, or the value is
+# cast back to FP16 in between: the attention-weight `mul` feeding a reduction,
+# and the `clamp` (`clip`/`maximum`) applied to a reduction's result.
+_STAT_REDUCTIONS = frozenset({"reduce_sum", "reduce_sum_square", "reduce_mean"})
+_STAT_GLUE_OP_TYPES = frozenset({"mul", "clip", "maximum"})
+
+
+def _input_vars(op):
+    for v in op.inputs.values():
+        if isinstance(v, (list, tuple)):
+            yield from v
+        else:
+            yield v
+
+
+def _keep_fp32(op) -> bool:
+    """True for ops that stay FP32 (used as the FP16 pass's inverted op_selector)."""
+    if op.op_type in _FP32_OP_TYPES:
+        return True
+    if op.op_type not in _STAT_GLUE_OP_TYPES:
+        return False
+    # Glue feeding a reduction (the weighted square / weighted x before .sum()).
+    if any(child.op_type in _STAT_REDUCTIONS for out in op.outputs for child in out.child_ops):
+        return True
+    # Glue consuming a reduction's result (the clamp before sqrt).
+    return any(v.op is not None and v.op.op_type in _STAT_REDUCTIONS for v in _input_vars(op))
+
+
+def _noise(rng: np.random.Generator, n: int, amplitude: float = 0.05) -> np.ndarray:
+    """Uniform float32 noise in [-amplitude, amplitude), shape [1, n].
+
+    Generated as float32 and scaled in place, so there is no float64 buffer or cast copy.
+    """
+    x = rng.random((1, n), dtype=np.float32)
+    x *= 2.0 * amplitude
+    x -= amplitude
+    return x
+
+
+def _cosine(a: np.ndarray, b: np.ndarray) -> float:
+    a = a.ravel()
+    b = b.ravel()
+    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-12))
+
+
+def _verify_buckets(mlmodel, refs: dict[int, tuple[np.ndarray, np.ndarray]], min_cosine: float, stage: str) -> bool:
+    """Check every exported window length against its PyTorch reference embedding.
+
+    `refs` maps sample count -> (waveform [1, T], PyTorch embedding). Aborts when a
+    prediction fails or its cosine is below `min_cosine`. Returns False (nothing
+    verified) on non-macOS hosts, where CoreML prediction is unavailable.
+    """
+    if sys.platform != "darwin":
+        print(f"CoreML {stage} check skipped (CoreML prediction requires macOS)")
+        return False
+    for b, (audio, reference) in refs.items():
+        try:
+            out = mlmodel.predict({"audio": audio})
+        except Exception as e:
+            raise SystemExit(
+                f"ERROR: CoreML {stage} prediction failed for {b} samples ({type(e).__name__}: {e}); not saving"
+            )
+        emb = np.asarray(next(iter(out.values())), dtype=np.float32)
+        cos = _cosine(emb, reference)
+        print(f"CoreML ({stage}) vs PyTorch embedding cosine similarity, {b} samples: {cos:.6f}")
+        if cos < min_cosine:
+            raise SystemExit(
+                f"ERROR: {stage} embedding cosine {cos:.6f} for {b} samples is below --min-cosine {min_cosine}; not saving"
+            )
+    return True
+
+
+# Window lengths (seconds) exported as enumerated shapes. Enumerated shapes keep
+# the model ANE-resident, unlike RangeDim which forces CPU execution.
+_WINDOW_BUCKETS_S = (1.0, 2.0, 3.0, 5.0)
+
+
+def _window_buckets(sr: int, n: int) -> list[int]:
+    """Sample counts for each enumerated window, always including the default `n`."""
+    return sorted({int(round(s * sr)) for s in _WINDOW_BUCKETS_S} | {n})
+
+
+def _audio_input(ct, buckets: list[int], n: int):
+    if len(buckets) == 1:
+        shape = (1, n)
+    else:
+        shape = ct.EnumeratedShapes(shapes=[(1, b) for b in buckets], default=(1, n))
+    return ct.TensorType(name="audio", shape=shape, dtype=np.float32)
+
+
+def _convert_to_coreml(model: torch.nn.Module, example: torch.Tensor, buckets: list[int], **convert_kwargs):
+    """Capture the pipeline graph and run `ct.convert` on it.
+
+    Returns `(mlmodel, buckets)` where `buckets` are the window lengths the model
+    actually accepts.
+
+    Prefer `torch.export` (concrete-int shapes, no TorchScript profiling pass) with
+    the sample axis marked dynamic over `buckets`. The ExportedProgram frontend
+    (coremltools 8.0+) has narrower op coverage than the TorchScript one, so if
+    either export or conversion fails, retry with a traced + frozen module. A trace
+    bakes SpeechBrain's shape-derived feature/length math in for the example's
+    length, so that path is converted fixed-shape.
+    """
+    import coremltools as ct
+
+    n = example.shape[1]
+    try:
+        samples = torch.export.Dim("samples", min=min(buckets), max=max(buckets))
+        exported = torch.export.export(model, (example,), dynamic_shapes=({1: samples},))
+        # coremltools expects the inference (ATen) dialect.
+        exported = exported.run_decompositions({})
+        mlmodel = ct.convert(exported, inputs=[_audio_input(ct, buckets, n)], **convert_kwargs)
+        print("Converted via torch.export")
+        return mlmodel, buckets
+    except Exception as e:
+        print(f"torch.export conversion failed ({type(e).__name__}: {e}); falling back to torch.jit.trace")
+
+    traced = torch.jit.trace(model, example, check_trace=False)
+    traced = torch.jit.freeze(traced)
+    mlmodel = ct.convert(traced, inputs=[_audio_input(ct, [n], n)], **convert_kwargs)
+    print(f"Converted via torch.jit.trace (fixed shape: {n} samples)")
+    return mlmodel, [n]
+
+
 def main() -> None:
     args = parse_args()
 
@@ -111,38 +264,74 @@ def main() -> None:
     model = ECAPAPipeline(classifier).to(device)
     model.eval()
 
-    # Trace with fixed input shape.
+    # Example input at the default window length.
     # Use non-zero audio to avoid tracing a degenerate path that could partially constant-fold.
     rng = np.random.default_rng(0)
-    example = torch.from_numpy(rng.standard_normal((1, n), dtype=np.float32) * 0.05).to(device)
-    with torch.no_grad():
-        _ = model(example)
+    noise1 = _noise(rng, n)
+    noise2 = _noise(rng, n)
+    example = torch.from_numpy(noise1).to(device)
 
     # Sanity check that embeddings are not constant for different inputs.
-    with torch.no_grad():
-        example2 = torch.from_numpy(rng.standard_normal((1, n), dtype=np.float32) * 0.05).to(device)
+    # `e1` doubles as the PyTorch reference for the CoreML parity checks below.
+    with torch.inference_mode():
+        example2 = torch.from_numpy(noise2).to(device)
         e1 = model(example).detach().cpu().numpy().ravel()
         e2 = model(example2).detach().cpu().numpy().ravel()
-        cos = float(np.dot(e1, e2) / (np.linalg.norm(e1) * np.linalg.norm(e2) + 1e-12))
+        cos = _cosine(e1, e2)
         print(f"Pre-trace embedding cosine similarity (random vs random): {cos:.6f}")
 
-    traced = torch.jit.trace(model, example, check_trace=False)
-    traced = torch.jit.freeze(traced)
-
     import coremltools as ct
 
-    mlmodel = ct.convert(
-        traced,
-        inputs=[ct.TensorType(name="audio", shape=example.shape, dtype=np.float32)],
+    print(
+        f"FP16 compute, except FP32 for op types: {', '.join(sorted(_FP32_OP_TYPES))}"
+        f" (plus {'/'.join(sorted(_STAT_GLUE_OP_TYPES))} adjacent to reductions)"
+    )
+    mlmodel, buckets = _convert_to_coreml(
+        model,
+        example,
+        _window_buckets(sr, n),
         convert_to="mlprogram",
+        compute_units=ct.ComputeUnit.CPU_AND_NE,
         minimum_deployment_target=ct.target.macOS14,
-        compute_precision=ct.precision.FLOAT16,
+        compute_precision=ct.transform.FP16ComputePrecision(
+            op_selector=lambda op: not _keep_fp32(op)
+        ),
+    )
+
+    # PyTorch reference embedding for every window length the model accepts.
+    refs = {n: (noise1, e1)}
+    with torch.inference_mode():
+        for b in buckets:
+            if b not in refs:
+                audio = _noise(rng, b)
+                emb = model(torch.from_numpy(audio).to(device)).detach().cpu().numpy().ravel()
+                refs[b] = (audio, emb)
+
+    _verify_buckets(mlmodel, refs, args.min_cosine, "fp16")
+
+    # int8 weight-only PTQ: the TDNN convs + final linear hold nearly all weights.
+    # Small tensors (biases, norm params) stay below the threshold and are untouched.
+    from coremltools.optimize.coreml import (
+        OpLinearQuantizerConfig,
+        OptimizationConfig,
+        linear_quantize_weights,
     )
 
+    qcfg = OptimizationConfig(
+        global_config=OpLinearQuantizerConfig(
+            mode="linear_symmetric", dtype="int8", weight_threshold=200_000
+        )
+    )
+    mlmodel = linear_quantize_weights(mlmodel, config=qcfg)
+
+    if not _verify_buckets(mlmodel, refs, args.min_cosine, "int8"):
+        print("WARNING: could not verify int8 embedding quality on this host (not macOS)")
+
     # Save as mlpackage (preferred); compilation to mlmodelc is done by `coremlc`.
     out_pkg = out_dir / "ecapa_tdnn_voxceleb.mlpackage"
     mlmodel.save(str(out_pkg))
     print(f"Wrote: {out_pkg}")
+    print(f"Window lengths: {', '.join(f'{b / sr:.2f}s' for b in buckets)}")
 
 
 if __name__ == "__main__":
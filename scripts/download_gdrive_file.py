@@ -14,6 +14,7 @@ from __future__ import annotations
 import html
 import os
 import re
+import shutil
 import sys
 import urllib.parse
 import urllib.request
@@ -24,25 +25,49 @@ def _die(msg: str, code: int = 2) -> None:
     raise SystemExit(code)
 
 
-def _read_text(resp: urllib.response.addinfourl) -> str:
+_CHUNK = 1024 * 1024
+_PEEK = 4096
+
+
+def _read_text(resp: urllib.response.addinfourl, head: bytes = b"") -> str:
     charset = resp.headers.get_content_charset() or "utf-8"
-    return resp.read().decode(charset, errors="replace")
+    return (head + resp.read()).decode(charset, errors="replace")
+
+
+def _looks_like_html(head: bytes) -> bool:
+    start = head.lstrip()[:64].lower()
+    return start.startswith(b"<!doctype html") or start.startswith(b"<html")
+
+
+def _write_stream(resp: urllib.response.addinfourl, output_path: str, head: bytes = b"") -> None:
+    """Stream `head` + the rest of `resp` to `output_path` in constant memory."""
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "wb") as f:
+        f.write(head)
+        shutil.copyfileobj(resp, f, length=_CHUNK)
+        if hasattr(os, "posix_fadvise"):
+            # Best-effort hint so large model files don't evict hot pages. DONTNEED
+            # only drops pages already written back; we don't fsync to force that,
+            # since waiting on a multi-GB flush costs more than the hint saves.
+            # macOS has no posix_fadvise, so there this is skipped entirely.
+            f.flush()
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+# Common patterns:
+#  - confirm=t
+#  - name="confirm" value="t"
+#  - href="/uc?export=download&confirm=t&id=..."
+# Combined into one alternation so the page is scanned once.
+_TOKEN_RE = re.compile(
+    r"confirm=([0-9A-Za-z_\-]+)"
+    r"|name=\"confirm\"\s+value=\"([0-9A-Za-z_\-]+)\""
+)
 
 
 def _extract_confirm_token(page_html: str) -> str | None:
-    # Common patterns:
-    #  - confirm=t
-    #  - name="confirm" value="t"
-    #  - href="/uc?export=download&confirm=t&id=..."
-    patterns = [
-        r"confirm=([0-9A-Za-z_\-]+)",
-        r"name=\"confirm\"\s+value=\"([0-9A-Za-z_\-]+)\"",
-    ]
-    for pat in patterns:
-        m = re.search(pat, page_html)
-        if m:
-            return m.group(1)
-    return None
+    m = _TOKEN_RE.search(page_html)
+    return (m.group(1) or m.group(2)) if m else None
 
 
 def download_gdrive_file(file_id: str, output_path: str) -> None:
@@ -55,14 +80,13 @@ def download_gdrive_file(file_id: str, output_path: str) -> None:
     # First request: may return the file directly, or a confirmation HTML page.
     with opener.open(url) as resp:
         ctype = resp.headers.get("Content-Type", "")
-        if "text/html" not in ctype.lower():
-            data = resp.read()
-            os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
-            with open(output_path, "wb") as f:
-                f.write(data)
+        # Peek the body too: the interstitial is occasionally served without text/html.
+        head = resp.read(_PEEK)
+        if "text/html" not in ctype.lower() and not _looks_like_html(head):
+            _write_stream(resp, output_path, head)
             return
 
-        page = _read_text(resp)
+        page = _read_text(resp, head)
 
     token = _extract_confirm_token(page)
     if not token:
@@ -78,11 +102,7 @@ def download_gdrive_file(file_id: str, output_path: str) -> None:
     )
 
     with opener.open(url2) as resp2:
-        data = resp2.read()
-
-    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
-    with open(output_path, "wb") as f:
-        f.write(data)
+        _write_stream(resp2, output_path)
 
 
 def main(argv: list[str]) -> int:
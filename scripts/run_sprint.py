@@ -18,7 +18,32 @@ def load_manifest():
     with open(path) as f:
         return json.load(f)["sprints"]
 
-def run_sprint(sprint_id, config):
+def swift_env():
+    # Deterministic hashing keeps hash-ordered work stable across retries.
+    return {**os.environ, "SWIFT_DETERMINISTIC_HASHING": "1"}
+
+def swift_test_cmd(tests, xml_path, parallel=False, num_workers=None):
+    # Swift test filter: "Class1|Class2"
+    cmd = [
+        "swift", "test",
+        "--filter", "|".join(tests),
+        "--xunit-output", str(xml_path),
+        "--disable-xctest",  # Prefer Swift Testing if possible, or omit if strictly XCTest
+        "--enable-swift-testing"
+    ]
+    if parallel:
+        # SwiftPM's own parallel runner: one build, one xunit output.
+        cmd.append("--parallel")
+        if num_workers:
+            cmd += ["--num-workers", str(num_workers)]
+    return cmd
+
+def spawn(cmd):
+    # Child writes straight to our terminal fds: no pipe, no buffering in between.
+    print(f"Executing: {' '.join(cmd)}")
+    return subprocess.Popen(cmd, stdout=sys.stdout, stderr=sys.stderr, env=swift_env())
+
+def run_sprint(sprint_id, config, parallel=False, num_workers=None):
     print(f"🚀 Running Tests for Sprint {sprint_id}: {config['name']}")
     
     # Prepare Output Dir
@@ -27,31 +52,20 @@ def run_sprint(sprint_id, config):
     
     xml_path = out_dir / "results.xml"
     
-    # Build Filter
-    # Swift test filter: "Class1|Class2"
     tests = config["tests"]
-    filter_arg = "|".join(tests)
-    
-    cmd = [
-        "swift", "test",
-        "--filter", filter_arg,
-        "--xunit-output", str(xml_path),
-        "--disable-xctest",  # Prefer Swift Testing if possible, or omit if strictly XCTest
-        "--enable-swift-testing"
-    ]
     
     # Run
-    print(f"Executing: {' '.join(cmd)}")
-    try:
-        subprocess.run(cmd, check=True)
-        print(f"✅ Success! Results: {xml_path}")
-    except subprocess.CalledProcessError:
+    rc = spawn(swift_test_cmd(tests, xml_path, parallel=parallel, num_workers=num_workers)).wait()
+    if rc != 0:
         print(f"❌ Tests Failed for Sprint {sprint_id}")
         sys.exit(1)
+    print(f"✅ Success! Results: {xml_path}")
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("sprint_id", help="Sprint ID (e.g. 01, 24)")
+    parser.add_argument("--parallel", action="store_true", help="Run tests in parallel (swift test --parallel)")
+    parser.add_argument("--num-workers", type=int, default=None, help="Worker count for --parallel")
     args = parser.parse_args()
     
     manifest = load_manifest()
@@ -60,7 +74,7 @@ def main():
         print("Available:", ", ".join(manifest.keys()))
         sys.exit(1)
         
-    run_sprint(args.sprint_id, manifest[args.sprint_id])
+    run_sprint(args.sprint_id, manifest[args.sprint_id], parallel=args.parallel, num_workers=args.num_workers)
 
 if __name__ == "__main__":
     main()
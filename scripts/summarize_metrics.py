@@ -2,103 +2,120 @@
 
 import argparse
 import json
+import mmap
 import os
+import tempfile
 from collections import defaultdict
+from contextlib import contextmanager
 from datetime import datetime, timezone
 from pathlib import Path
 
-
-def _read_jsonl(path: Path):
-    if not path.exists():
-        return []
-    out = []
-    with path.open("r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Events are read and written as bytes; orjson parses/emits bytes directly.
+try:
+    import orjson
+
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+except ImportError:
+    _loads = json.loads
+
+    def _dumps(o):
+        return json.dumps(o, ensure_ascii=False).encode("utf-8")
+
+# Events are de-duplicated on these fields (last one wins).
+_KEY_FIELDS = ("suite", "label", "width", "height", "test")
+
+
+def _read_jsonl(path: Path, needle: bytes):
+    """Yield parsed events from lines of a JSONL file that contain `needle`.
+
+    The file is mmapped and byte-scanned for `needle`; only matching lines are
+    parsed, and malformed ones are skipped. This only prefilters on one spelling:
+    a line that encodes the same value differently (e.g. `\\/` or `\\u00e9`
+    escapes) is not parsed at all. Callers still check the parsed event.
+    """
+    if not path.exists() or path.stat().st_size == 0:
+        return
+    with path.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        find, rfind = mm.find, mm.rfind
+        i = find(needle)
+        while i != -1:
+            start = rfind(b"\n", 0, i) + 1
+            end = find(b"\n", i)
+            if end == -1:
+                end = len(mm)
             try:
-                out.append(json.loads(line))
+                yield _loads(mm[start:end])
             except json.JSONDecodeError:
                 # Ignore malformed lines (partial writes, etc.)
-                continue
-    return out
-
-
-def _fmt_ms(v):
-    return "" if v is None else f"{v:.2f}"
-
-
-def _fmt(v, places=6):
-    return "" if v is None else f"{v:.{places}f}"
+                # (orjson.JSONDecodeError subclasses json.JSONDecodeError.)
+                pass
+            i = find(needle, end)
+
+
+_RUNS_MARKER = b"## Runs\n\n"
+
+
+def _write_atomic(path: Path, data: bytes):
+    """Write via a unique temp file + os.replace so readers never see a partial file."""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        # mkstemp creates 0600; keep the index readable like a normal write would.
+        os.chmod(tmp, path.stat().st_mode & 0o777 if path.exists() else 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+@contextmanager
+def _locked(path: Path):
+    """Hold an exclusive flock on a sidecar `.<name>.lock` file (no-op without fcntl)."""
+    if fcntl is None:
+        yield
+        return
+    with open(path.parent / f".{path.name}.lock", "wb") as lock:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
 
 
 def _safe(s):
     return s if s is not None else ""
 
 
-def main():
-    ap = argparse.ArgumentParser(description="Summarize perf+color events for a given runID")
-    ap.add_argument("--run-id", required=True)
-    ap.add_argument("--out-dir", required=True)
-    ap.add_argument("--repo-root", default=None)
-    args = ap.parse_args()
-
-    repo_root = Path(args.repo_root).resolve() if args.repo_root else Path(__file__).resolve().parents[1]
-    out_dir = Path(args.out_dir).resolve()
-    out_dir.mkdir(parents=True, exist_ok=True)
-
-    perf_jsonl = repo_root / "test_outputs" / "perf" / "perf.jsonl"
-    events = [e for e in _read_jsonl(perf_jsonl) if e.get("runID") == args.run_id]
-
-    # Persist immutable slice for the run.
-    events_jsonl = out_dir / "events.jsonl"
-    with events_jsonl.open("w", encoding="utf-8") as f:
-        for e in events:
-            f.write(json.dumps(e, ensure_ascii=False) + "\n")
+def _res(r):
+    return f"{r['w']}x{r['h']}" if r.get("w") and r.get("h") else ""
 
-    # Build summary.
-    header = {
-        "runID": args.run_id,
-        "count": len(events),
-        "generatedUTC": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
-        "osVersion": events[0].get("osVersion") if events else None,
-        "arch": events[0].get("processArch") if events else None,
-        "firstTimestamp": events[0].get("timestampISO8601") if events else None,
-    }
 
+def _classify(last_by_key):
+    """Split de-duplicated events into (perf, mem, color, studio, ocio) row lists."""
     perf_rows = []
     mem_rows = []
     color_rows = []
     studio_rows = []
     ocio_rows = []
 
-    # Prefer last event per (suite,label,width,height,test) in case repeats happened.
-    last_by_key = {}
-    for e in events:
-        key = (
-            e.get("suite"),
-            e.get("label"),
-            e.get("width"),
-            e.get("height"),
-            e.get("test"),
-        )
-        last_by_key[key] = e
-
-    for e in last_by_key.values():
-        suite = e.get("suite")
-        label = e.get("label")
-
+    for (suite, label, w, h, test), e in last_by_key.items():
         if e.get("avgMs") is not None:
             perf_rows.append(
                 {
                     "suite": suite,
                     "label": label,
-                    "w": e.get("width"),
-                    "h": e.get("height"),
+                    "w": w,
+                    "h": h,
                     "frames": e.get("frames"),
                     "avgMs": e.get("avgMs"),
-                    "test": e.get("test"),
+                    "test": test,
                 }
             )
 
@@ -109,7 +126,7 @@ def main():
                     "label": label,
                     "peakRSSDeltaMB": e.get("peakRSSDeltaMB"),
                     "message": e.get("message"),
-                    "test": e.get("test"),
+                    "test": test,
                 }
             )
 
@@ -121,7 +138,7 @@ def main():
                     "deltaEAvg": e.get("deltaE2000Avg"),
                     "deltaEMax": e.get("deltaE2000Max"),
                     "worst": e.get("deltaEWorstPatch"),
-                    "test": e.get("test"),
+                    "test": test,
                 }
             )
 
@@ -133,7 +150,7 @@ def main():
                     "meanAbs": e.get("lutMeanAbsErr"),
                     "maxAbs": e.get("lutMaxAbsErr"),
                     "worst": e.get("lutWorstPatch"),
-                    "test": e.get("test"),
+                    "test": test,
                 }
             )
 
@@ -145,7 +162,7 @@ def main():
                     "name": e.get("ocioBakeName"),
                     "meanAbs": e.get("ocioBakeMeanAbsErr"),
                     "maxAbs": e.get("ocioBakeMaxAbsErr"),
-                    "test": e.get("test"),
+                    "test": test,
                 }
             )
 
@@ -155,112 +172,197 @@ def main():
     studio_rows.sort(key=lambda r: (r["label"] or "", r["test"] or ""))
     ocio_rows.sort(key=lambda r: (_safe(r["name"]), r["test"] or ""))
 
+    return perf_rows, mem_rows, color_rows, studio_rows, ocio_rows
+
+
+# Renderers format each cell inline. Columns that routed a row into its table
+# (e.g. avgMs for perf) are known non-None; only optional metric columns keep a
+# None check. Text columns use `or ""` (labels/names/tests are strings or None).
+
+
+def _render_perf(rows) -> str:
+    res = _res
+    buf = ["## Performance\n\n"]
+    if not rows:
+        buf.append("(no perf events found for this run)\n\n")
+    else:
+        buf.append("| label | res | frames | avgMs | suite | test |\n")
+        buf.append("|---|---:|---:|---:|---|---|\n")
+        buf.extend(
+            f"| {r['label'] or ''} | {res(r)} | {r.get('frames','')} | {r['avgMs']:.2f} | {r['suite'] or ''} | {r['test'] or ''} |\n"
+            for r in rows
+        )
+        buf.append("\n")
+    return "".join(buf)
+
+
+def _render_mem(rows) -> str:
+    buf = ["## Memory\n\n"]
+    if not rows:
+        buf.append("(no memory events found for this run)\n\n")
+    else:
+        buf.append("| label | peakRSSDeltaMB | message | suite | test |\n")
+        buf.append("|---|---:|---|---|---|\n")
+        buf.extend(
+            f"| {r['label'] or ''} | {r['peakRSSDeltaMB']:.3f} | {r['message'] or ''} | {r['suite'] or ''} | {r['test'] or ''} |\n"
+            for r in rows
+        )
+        buf.append("\n")
+    return "".join(buf)
+
+
+def _render_color(rows) -> str:
+    fmt = "{:.4f}".format
+    buf = ["## Color (ΔE2000)\n\n"]
+    if not rows:
+        buf.append("(no ΔE events found for this run)\n\n")
+    else:
+        buf.append("| label | ΔE avg | ΔE max | worst | suite | test |\n")
+        buf.append("|---|---:|---:|---|---|---|\n")
+        buf.extend(
+            f"| {r['label'] or ''} | {fmt(r['deltaEAvg']) if r['deltaEAvg'] is not None else ''} | {fmt(r['deltaEMax']) if r['deltaEMax'] is not None else ''} | {r['worst'] or ''} | {r['suite'] or ''} | {r['test'] or ''} |\n"
+            for r in rows
+        )
+        buf.append("\n")
+    return "".join(buf)
+
+
+def _render_studio(rows) -> str:
+    fmt = "{:.8f}".format
+    buf = ["## Studio LUT Reference Match\n\n"]
+    if not rows:
+        buf.append("(no Studio LUT match events found for this run)\n\n")
+    else:
+        buf.append("| label | meanAbsErr | maxAbsErr | worst | suite | test |\n")
+        buf.append("|---|---:|---:|---|---|---|\n")
+        buf.extend(
+            f"| {r['label'] or ''} | {fmt(r['meanAbs']) if r['meanAbs'] is not None else ''} | {fmt(r['maxAbs']) if r['maxAbs'] is not None else ''} | {r['worst'] or ''} | {r['suite'] or ''} | {r['test'] or ''} |\n"
+            for r in rows
+        )
+        buf.append("\n")
+    return "".join(buf)
+
+
+def _render_ocio(rows) -> str:
+    fmt = "{:.10f}".format
+    buf = ["## OCIO Re-bake Match\n\n"]
+    if not rows:
+        buf.append("(no OCIO bake match events found for this run)\n\n")
+    else:
+        buf.append("| name | meanAbsErr | maxAbsErr | suite | test |\n")
+        buf.append("|---|---:|---:|---|---|\n")
+        buf.extend(
+            f"| {r['name'] or ''} | {fmt(r['meanAbs']) if r['meanAbs'] is not None else ''} | {fmt(r['maxAbs']) if r['maxAbs'] is not None else ''} | {r['suite'] or ''} | {r['test'] or ''} |\n"
+            for r in rows
+        )
+        buf.append("\n")
+    return "".join(buf)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Summarize perf+color events for a given runID")
+    ap.add_argument("--run-id", required=True)
+    ap.add_argument("--out-dir", required=True)
+    ap.add_argument("--repo-root", default=None)
+    args = ap.parse_args()
+
+    repo_root = Path(args.repo_root).resolve() if args.repo_root else Path(__file__).resolve().parents[1]
+    out_dir = Path(args.out_dir).resolve()
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    perf_jsonl = repo_root / "test_outputs" / "perf" / "perf.jsonl"
+    run_id = args.run_id
+
+    # Single pass: filter to the run, persist the immutable slice, and keep the
+    # last event per (suite,label,width,height,test) in case repeats happened.
+    # Only lines containing the JSON-encoded runID are parsed at all. The needle is
+    # the exact spelling PerfLogger writes (JSONEncoder with .withoutEscapingSlashes,
+    # non-ASCII left unescaped); events whose runID is spelled with `\/` or `\uXXXX`
+    # escapes would be skipped.
+    needle = json.dumps(run_id, ensure_ascii=False).encode("utf-8")
+    events_jsonl = out_dir / "events.jsonl"
+    count = 0
+    first = {}
+    last_by_key = {}
+    with events_jsonl.open("wb") as f:
+        write = f.write
+        for e in _read_jsonl(perf_jsonl, needle):
+            if e.get("runID") != run_id:
+                continue
+            if not count:
+                first = e
+            count += 1
+            write(_dumps(e) + b"\n")
+            last_by_key[tuple(e.get(k) for k in _KEY_FIELDS)] = e
+
+    # Build summary.
+    header = {
+        "runID": run_id,
+        "count": count,
+        "generatedUTC": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "osVersion": first.get("osVersion"),
+        "arch": first.get("processArch"),
+        "firstTimestamp": first.get("timestampISO8601"),
+    }
+
+    perf_rows, mem_rows, color_rows, studio_rows, ocio_rows = _classify(last_by_key)
+
     summary_md = out_dir / "summary.md"
-    with summary_md.open("w", encoding="utf-8") as f:
-        f.write(f"# MetaVis Metrics Run\n\n")
-        f.write(f"- runID: `{header['runID']}`\n")
-        f.write(f"- events: `{header['count']}`\n")
-        if header.get("osVersion"):
-            f.write(f"- os: `{header['osVersion']}`\n")
-        if header.get("arch"):
-            f.write(f"- arch: `{header['arch']}`\n")
-        if header.get("generatedUTC"):
-            f.write(f"- generatedUTC: `{header['generatedUTC']}`\n")
-        f.write("\n")
-
-        f.write("## Performance\n\n")
-        if not perf_rows:
-            f.write("(no perf events found for this run)\n\n")
-        else:
-            f.write("| label | res | frames | avgMs | suite | test |\n")
-            f.write("|---|---:|---:|---:|---|---|\n")
-            for r in perf_rows:
-                res = f"{r['w']}x{r['h']}" if r.get("w") and r.get("h") else ""
-                f.write(
-                    f"| {_safe(r['label'])} | {res} | {r.get('frames','')} | {_fmt_ms(r['avgMs'])} | {_safe(r['suite'])} | {_safe(r['test'])} |\n"
-                )
-            f.write("\n")
-
-        f.write("## Memory\n\n")
-        if not mem_rows:
-            f.write("(no memory events found for this run)\n\n")
-        else:
-            f.write("| label | peakRSSDeltaMB | message | suite | test |\n")
-            f.write("|---|---:|---|---|---|\n")
-            for r in mem_rows:
-                f.write(
-                    f"| {_safe(r['label'])} | {_fmt(r['peakRSSDeltaMB'], places=3)} | {_safe(r['message'])} | {_safe(r['suite'])} | {_safe(r['test'])} |\n"
-                )
-            f.write("\n")
-
-        f.write("## Color (ΔE2000)\n\n")
-        if not color_rows:
-            f.write("(no ΔE events found for this run)\n\n")
-        else:
-            f.write("| label | ΔE avg | ΔE max | worst | suite | test |\n")
-            f.write("|---|---:|---:|---|---|---|\n")
-            for r in color_rows:
-                f.write(
-                    f"| {_safe(r['label'])} | {_fmt(r['deltaEAvg'], places=4)} | {_fmt(r['deltaEMax'], places=4)} | {_safe(r['worst'])} | {_safe(r['suite'])} | {_safe(r['test'])} |\n"
-                )
-            f.write("\n")
-
-        f.write("## Studio LUT Reference Match\n\n")
-        if not studio_rows:
-            f.write("(no Studio LUT match events found for this run)\n\n")
-        else:
-            f.write("| label | meanAbsErr | maxAbsErr | worst | suite | test |\n")
-            f.write("|---|---:|---:|---|---|---|\n")
-            for r in studio_rows:
-                f.write(
-                    f"| {_safe(r['label'])} | {_fmt(r['meanAbs'], places=8)} | {_fmt(r['maxAbs'], places=8)} | {_safe(r['worst'])} | {_safe(r['suite'])} | {_safe(r['test'])} |\n"
-                )
-            f.write("\n")
-
-        f.write("## OCIO Re-bake Match\n\n")
-        if not ocio_rows:
-            f.write("(no OCIO bake match events found for this run)\n\n")
-        else:
-            f.write("| name | meanAbsErr | maxAbsErr | suite | test |\n")
-            f.write("|---|---:|---:|---|---|\n")
-            for r in ocio_rows:
-                f.write(
-                    f"| {_safe(r['name'])} | {_fmt(r['meanAbs'], places=10)} | {_fmt(r['maxAbs'], places=10)} | {_safe(r['suite'])} | {_safe(r['test'])} |\n"
-                )
-            f.write("\n")
-
-        f.write("## Files\n\n")
-        rel_events = os.path.relpath(events_jsonl, repo_root)
-        rel_summary = os.path.relpath(summary_md, repo_root)
-        f.write(f"- events: `{rel_events}`\n")
-        f.write(f"- summary: `{rel_summary}`\n")
+
+    buf = ["# MetaVis Metrics Run\n\n"]
+    buf.append(f"- runID: `{header['runID']}`\n")
+    buf.append(f"- events: `{header['count']}`\n")
+    if header.get("osVersion"):
+        buf.append(f"- os: `{header['osVersion']}`\n")
+    if header.get("arch"):
+        buf.append(f"- arch: `{header['arch']}`\n")
+    if header.get("generatedUTC"):
+        buf.append(f"- generatedUTC: `{header['generatedUTC']}`\n")
+    buf.append("\n")
+
+    buf.append(_render_perf(perf_rows))
+    buf.append(_render_mem(mem_rows))
+    buf.append(_render_color(color_rows))
+    buf.append(_render_studio(studio_rows))
+    buf.append(_render_ocio(ocio_rows))
+
+    buf.append("## Files\n\n")
+    rel_events = os.path.relpath(events_jsonl, repo_root)
+    rel_summary = os.path.relpath(summary_md, repo_root)
+    buf.append(f"- events: `{rel_events}`\n")
+    buf.append(f"- summary: `{rel_summary}`\n")
+
+    summary_md.write_text("".join(buf), encoding="utf-8")
 
     # Update a simple index for historical tracking.
     metrics_root = repo_root / "test_outputs" / "metrics"
     metrics_root.mkdir(parents=True, exist_ok=True)
     index_md = metrics_root / "README.md"
 
-    if not index_md.exists():
-        index_md.write_text(
-            "# Metrics Runs\n\n"
-            "Each run is stored under `test_outputs/metrics/<runID>/`.\n\n"
-            "Run with: `scripts/run_metrics.sh`\n\n"
-            "## Runs\n\n",
-            encoding="utf-8",
-        )
-
     rel_run = os.path.relpath(out_dir, metrics_root)
-    line = f"- `{args.run_id}`: `{rel_run}/summary.md`\n"
-
-    existing = index_md.read_text(encoding="utf-8")
-    if line not in existing:
-        # Append newest at the top of the Runs section if possible.
-        parts = existing.split("## Runs\n\n", 1)
-        if len(parts) == 2:
-            head, rest = parts
-            index_md.write_text(head + "## Runs\n\n" + line + rest, encoding="utf-8")
-        else:
-            index_md.write_text(existing + "\n" + line, encoding="utf-8")
+    line = f"- `{args.run_id}`: `{rel_run}/summary.md`\n".encode("utf-8")
+
+    # Serialize the read/splice/replace across concurrent runs; os.replace alone
+    # only prevents torn writes, not lost updates.
+    with _locked(index_md):
+        if not index_md.exists():
+            _write_atomic(
+                index_md,
+                b"# Metrics Runs\n\n"
+                b"Each run is stored under `test_outputs/metrics/<runID>/`.\n\n"
+                b"Run with: `scripts/run_metrics.sh`\n\n"
+                + _RUNS_MARKER,
+            )
+
+        existing = index_md.read_bytes()
+        if line not in existing:
+            # Insert newest at the top of the Runs section if possible.
+            idx = existing.find(_RUNS_MARKER)
+            if idx != -1:
+                idx += len(_RUNS_MARKER)
+                _write_atomic(index_md, existing[:idx] + line + existing[idx:])
+            else:
+                _write_atomic(index_md, existing + b"\n" + line)
 
     print(f"[summarize_metrics] wrote: {summary_md}")
     print(f"[summarize_metrics] wrote: {events_jsonl}")